@@ -0,0 +1,97 @@
+import logging
+import time
+from typing import Dict, Type
+
+from booli_crawler.crawler import Crawler, CrawlQueue, QueuedUrl, crawl_page
+from booli_crawler.page_fetcher import PageFetcher
+from booli_crawler.parser import Parser
+from booli_crawler.sold_listing_list import SoldListingList
+from booli_crawler.url import Url
+
+N_CRAWLERS = [1, 2, 4, 8, 16]
+
+N_PAGES = 2000
+N_LISTINGS_PER_PAGE = 35
+
+LISTING = {
+    'soldPrice': {'raw': 1_000_000},
+    'objectType': 'Lägenhet',
+    'rooms': {'formatted': '3 rum'},
+    'livingArea': {'formatted': '80½ m²'},
+    'streetAddress': 'Street',
+    'descriptiveAreaName': 'District',
+    'soldDate': '2023-06-20',
+    'url': '/bostad/1',
+}
+
+PAGE_DATA = {'props': {'pageProps': {f'SoldProperty:{i}': LISTING for i in range(N_LISTINGS_PER_PAGE)}}}
+
+
+class LocalPageFetcher(PageFetcher):
+
+    def fetch_page_data(self, url: Url) -> Dict:
+        return PAGE_DATA
+
+
+class AppendPerListingCrawler(Crawler):
+    """
+    Appends each listing directly to the shared sold listings,
+    i.e., takes the global lock once per listing (as before
+    buffering per crawler).
+    """
+
+    def _crawl(self, queued_url: QueuedUrl):
+        page_sold_listings = crawl_page(parser=self._parser, page_fetcher=self._page_fetcher, url=queued_url.url)
+
+        for sold_listing in page_sold_listings:
+            queued_url.sold_listings.append(sold_listing)
+
+        self._page_crawled_cb()
+
+
+def measure_throughput(n_crawlers: int, crawler_type: Type[Crawler]) -> float:
+    sold_listings = SoldListingList()
+    url_queue = CrawlQueue()
+
+    for page in range(N_PAGES):
+        url_queue.put_url(url=f'page{page}', sold_listings=sold_listings)
+
+    crawlers = [crawler_type(parser=Parser(),
+                             page_fetcher=LocalPageFetcher(),
+                             url_queue=url_queue,
+                             page_crawled_cb=lambda: None)
+                for _ in range(n_crawlers)]
+
+    t_start = time.perf_counter()
+
+    for crawler in crawlers:
+        crawler.start()
+
+    url_queue.join()
+
+    for crawler in crawlers:
+        crawler.stop()
+
+    return len(sold_listings.url) / (time.perf_counter() - t_start)
+
+
+def main():
+    """
+    Measures the throughput (listings/s) of Crawlers (parsing and appending
+    listings of local pages to a shared SoldListingList) as the number of
+    crawlers scales. Compares buffering per crawler (shipped) with appending
+    per listing (global lock per listing).
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    logging.info(f"{'n_crawlers':>10} {'per listing [listings/s]':>25} {'buffered [listings/s]':>25}")
+
+    for n_crawlers in N_CRAWLERS:
+        per_listing = measure_throughput(n_crawlers, AppendPerListingCrawler)
+        buffered = measure_throughput(n_crawlers, Crawler)
+
+        logging.info(f"{n_crawlers:>10} {per_listing:>25,.0f} {buffered:>25,.0f}")
+
+
+if __name__ == '__main__':
+    main()
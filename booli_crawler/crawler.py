@@ -1,44 +1,85 @@
-import json
+import itertools
 import logging
 import queue
+import random
 import re
 import threading
 import time
-from http import HTTPStatus
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Tuple, NamedTuple, TypeVar
 
-import bs4
 import requests
 
+from booli_crawler.page_fetcher import PageFetcher, PageFetchError
 from booli_crawler.parser import Parser
 from booli_crawler.sold_listing_list import SoldListingList
-from booli_crawler.url import UrlQueue
+from booli_crawler.types import SoldListing
+from booli_crawler.url import Url
 
 ONE_MS_IN_S = 0.001
 
-TOO_MANY_REQUESTS_BACKOFF_FACTOR = 1.3
+MAX_PAGE_RETRIES = 3
+PAGE_RETRY_BACKOFF_S = 1.0
+PAGE_RETRY_JITTER = 0.5
+
+# Errors of fetching a page, i.e., which may pass on retry (unlike parse errors).
+RETRIED_ERRORS = (requests.RequestException, PageFetchError)
+
+T = TypeVar('T')
 
 logger = logging.getLogger(__name__)
 
 
+class QueuedUrl(NamedTuple):
+    url: Url
+    sold_listings: SoldListingList
+    n_failures: int = 0
+    retry_at_s: float = 0.0
+
+
+class CrawlQueue(queue.Queue, object):
+
+    def __init__(self):
+        """
+        Queue of urls (QueuedUrl), each paired with the sold listings
+        to which the listings of the url are appended. A failed url
+        is requeued with its number of failures and when to retry it.
+        """
+        super(CrawlQueue, self).__init__()
+
+    def put_url(self, url: Url, sold_listings: SoldListingList):
+        self.put(QueuedUrl(url=url, sold_listings=sold_listings))
+
+
 class Crawler:
 
     def __init__(self,
                  parser: Parser,
-                 url_queue: UrlQueue,
-                 sold_listings: SoldListingList,
-                 page_crawled_cb: Callable):
+                 page_fetcher: PageFetcher,
+                 url_queue: CrawlQueue,
+                 page_crawled_cb: Callable,
+                 page_failed_cb: Callable[[Url, SoldListingList], None] = lambda url, sold_listings: None):
         """
         Crawls through sold listings given by urls in the
-        queue. Appends listings to sold_listings.
+        queue. Appends listings to the sold listings paired
+        with each url.
+
+        Listings are buffered per crawler (thread) and appended
+        in bulk when stopped (or if the thread dies), i.e., crawlers
+        don't contend on the sold listings lock while crawling.
 
         Calls page_crawled_cb every time a new pages has
-        been parsed.
+        been parsed. A page which fails to be fetched is requeued
+        with a jittered exponential backoff. After MAX_PAGE_RETRIES
+        (or at once if it fails to be parsed) it's given up on and
+        page_failed_cb is called.
         """
         self._url_queue = url_queue
-        self._sold_listings = sold_listings
         self._page_crawled_cb = page_crawled_cb
+        self._page_failed_cb = page_failed_cb
         self._parser = parser
+        self._page_fetcher = page_fetcher
+
+        self._buffers: Dict[int, Tuple[SoldListingList, List[SoldListing]]] = {}
 
         self._run = False
         self._thread = threading.Thread(target=self._exec)
@@ -52,57 +93,127 @@ class Crawler:
         self._thread.start()
 
     def _exec(self):
-        while self._run:
-            try:
-                url = self._url_queue.get(block=False)
-            except queue.Empty:
-                url = None
-
-            if url is not None:
-                response = self._request_with_retry(url=url)
-
-                soup = bs4.BeautifulSoup(response.content, 'html.parser')
-
-                page_data_raw = soup.find(name='script', attrs={'id': re.compile(r'__NEXT_DATA__')})
-                page_data_json = json.loads(page_data_raw.string)
-
-                listings = self._find_listings(page_data_json)
-
-                for listing in listings:
-                    self._sold_listings.append(self._parser.parse_listing(listing))
-
-                self._page_crawled_cb()
-            else:
-                time.sleep(ONE_MS_IN_S)
-
-    def _find_listings(self, data: Dict, found_listings: List[Dict] = None) -> List[Dict]:
-        if found_listings is None:
-            found_listings = []
-
-        regexp = re.compile(r'SoldProperty:\d+')
-
-        for key in data.keys():
-            if regexp.search(key):
-                found_listings.append(data[key])
-            elif isinstance(data[key], Dict):
-                self._find_listings(data[key], found_listings)
+        try:
+            while self._run:
+                try:
+                    queued_url = self._url_queue.get(block=False)
+                except queue.Empty:
+                    queued_url = None
+
+                if queued_url is None:
+                    time.sleep(ONE_MS_IN_S)
+                elif queued_url.retry_at_s > time.monotonic():
+                    self._url_queue.put(queued_url)
+                    self._url_queue.task_done()
+
+                    time.sleep(ONE_MS_IN_S)
+                else:
+                    try:
+                        self._crawl(queued_url)
+                    finally:
+                        self._url_queue.task_done()
+        finally:
+            self._flush_buffers()
+
+    def _crawl(self, queued_url: QueuedUrl):
+        try:
+            sold_listings = crawl_page(parser=self._parser,
+                                       page_fetcher=self._page_fetcher,
+                                       url=queued_url.url)
+        except RETRIED_ERRORS as e:
+            self._retry_or_give_up(queued_url, error=e)
+        except Exception as e:
+            logger.warning(f'Giving up on {queued_url.url} as it failed to be parsed: {e!r}')
+
+            self._page_failed_cb(queued_url.url, queued_url.sold_listings)
+        else:
+            _, buffer = self._buffers.setdefault(id(queued_url.sold_listings), (queued_url.sold_listings, []))
+            buffer.extend(sold_listings)
+
+            self._page_crawled_cb()
+
+    def _retry_or_give_up(self, queued_url: QueuedUrl, error: Exception):
+        n_failures = queued_url.n_failures + 1
+
+        if n_failures > MAX_PAGE_RETRIES:
+            logger.warning(f'Giving up on {queued_url.url} after {n_failures} failures: {error!r}')
+
+            self._page_failed_cb(queued_url.url, queued_url.sold_listings)
+        else:
+            backoff_s = get_retry_backoff_s(n_failures=n_failures)
+
+            logger.debug(f'{threading.get_native_id()}: Failed on {queued_url.url} ({error!r}). '
+                         f'Retrying in {backoff_s:.1f} s.')
+
+            self._url_queue.put(queued_url._replace(n_failures=n_failures,
+                                                    retry_at_s=time.monotonic() + backoff_s))
+
+    def _flush_buffers(self):
+        for sold_listings, buffer in self._buffers.values():
+            sold_listings.extend(buffer)
+
+        self._buffers.clear()
+
+
+def crawl_page(parser: Parser, page_fetcher: PageFetcher, url: Url) -> List[SoldListing]:
+    """
+    Fetches, finds and parses the sold listings of a single page.
+    """
+    return parse_listings(parser=parser, page_data=page_fetcher.fetch_page_data(url=url))
+
+
+def crawl_page_with_retry(parser: Parser, page_fetcher: PageFetcher, url: Url) -> List[SoldListing]:
+    """
+    Crawls a single page in the calling thread, see call_with_retry.
+    """
+    return call_with_retry(lambda: crawl_page(parser=parser, page_fetcher=page_fetcher, url=url), url=url)
+
+
+def call_with_retry(func: Callable[[], T], url: Url) -> T:
+    """
+    Calls func (requesting url) in the calling thread, retrying fetch errors
+    with the same backoff as a Crawler. Raises the last error after
+    MAX_PAGE_RETRIES, or any other error at once.
+    """
+    for n_failures in itertools.count(start=1):
+        try:
+            return func()
+        except RETRIED_ERRORS as e:
+            if n_failures > MAX_PAGE_RETRIES:
+                raise e
+
+            backoff_s = get_retry_backoff_s(n_failures=n_failures)
+
+            logger.debug(f'Failed on {url} ({e!r}). Retrying in {backoff_s:.1f} s.')
+
+            time.sleep(backoff_s)
+
+
+def get_retry_backoff_s(n_failures: int) -> float:
+    """
+    Exponential backoff with jitter, given number of failures (> 0).
+    """
+    return PAGE_RETRY_BACKOFF_S * 2 ** (n_failures - 1) * random.uniform(1 - PAGE_RETRY_JITTER,
+                                                                        1 + PAGE_RETRY_JITTER)
 
-        return found_listings
 
-    @staticmethod
-    def _request_with_retry(url):
-        i_retry = 0
-        response = requests.get(url=url)
+def parse_listings(parser: Parser, page_data: Dict) -> List[SoldListing]:
+    """
+    Finds and parses the sold listings given the page data.
+    """
+    return [parser.parse_listing(listing) for listing in _find_listings(page_data)]
 
-        while response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
-            retry_after_s = int(response.headers["Retry-After"])
-            sleep_s = retry_after_s * TOO_MANY_REQUESTS_BACKOFF_FACTOR ** i_retry
 
-            logger.debug(f'{threading.get_native_id()}: Too many requests. Sleeping {sleep_s} s.')
+def _find_listings(data: Dict, found_listings: List[Dict] = None) -> List[Dict]:
+    if found_listings is None:
+        found_listings = []
 
-            time.sleep(sleep_s)
+    regexp = re.compile(r'SoldProperty:\d+')
 
-            response = requests.get(url=url)
-            i_retry += 1
+    for key in data.keys():
+        if regexp.search(key):
+            found_listings.append(data[key])
+        elif isinstance(data[key], Dict):
+            _find_listings(data[key], found_listings)
 
-        return response
+    return found_listings
@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+import threading
+import time
+from http import HTTPStatus
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import bs4
+import requests
+
+from booli_crawler.url import Url, get_data_url, get_rewrite_query
+
+TOO_MANY_REQUESTS_BACKOFF_FACTOR = 1.3
+
+MAX_DATA_ROUTE_FAILURES = 3
+
+REQUEST_TIMEOUT_S = 30
+
+logger = logging.getLogger(__name__)
+
+
+class PageFetchError(Exception):
+    """Raised when a page could not be fetched or lacks page data"""
+    pass
+
+
+class PageFetcher:
+
+    def __init__(self, use_data_route: bool = False):
+        """
+        Fetches the page data (__NEXT_DATA__) of pages.
+
+        If use_data_route, the Next.js data route (json only) is
+        requested instead of the full html page. The build id and the
+        page (route) of the url needed for the data route are found in
+        the fetched html pages. Falls back to the html page if the data
+        route fails. Stops using it if not found (404) or after
+        MAX_DATA_ROUTE_FAILURES failures in a row, until an html page
+        shows another build id (a new deploy).
+        """
+        self._use_data_route = use_data_route
+        self._build_id = None
+        self._failed_build_id = None
+        self._n_data_route_failures = 0
+        self._routes: Dict[str, Tuple[str, Dict[str, str]]] = {}
+
+    def fetch_html(self, url: Url) -> str:
+        response = _request_with_retry(url=url)
+
+        if response.status_code != HTTPStatus.OK:
+            raise PageFetchError(f"Got status {response.status_code} from url: {url}")
+
+        return response.content.decode()
+
+    def fetch_page_data(self, url: Url) -> Dict:
+        build_id = self._build_id
+        route = self._routes.get(urlsplit(url).path)
+
+        if self._use_data_route and build_id is not None and build_id != self._failed_build_id \
+                and route is not None:
+            page_data = self._fetch_data_route(url=url, build_id=build_id, route=route)
+
+            if page_data is not None:
+                return page_data
+
+        return self.find_page_data(self.fetch_html(url=url), url=url)
+
+    def find_page_data(self, html: str, url: Optional[Url] = None) -> Dict:
+        """
+        Finds the page data in the html (of url, if given to find its route).
+        """
+        soup = bs4.BeautifulSoup(html, 'html.parser')
+
+        page_data_raw = soup.find(name='script', attrs={'id': re.compile(r'__NEXT_DATA__')})
+
+        if page_data_raw is None:
+            raise PageFetchError("Could not find __NEXT_DATA__ in page")
+
+        page_data = json.loads(page_data_raw.string)
+
+        if page_data.get('buildId', self._build_id) != self._build_id:
+            self._build_id = page_data['buildId']
+            self._n_data_route_failures = 0
+
+        if url is not None and 'page' in page_data:
+            self._routes[urlsplit(url).path] = (page_data['page'],
+                                                get_rewrite_query(url=url, query=page_data.get('query', {})))
+
+        return page_data
+
+    def _fetch_data_route(self, url: Url, build_id: str, route: Tuple[str, Dict[str, str]]) -> Optional[Dict]:
+        page, query = route
+        response = _request_with_retry(url=get_data_url(url=url, build_id=build_id, page=page, query=query))
+
+        page_data = _parse_data_route(response.content) if response.status_code == HTTPStatus.OK else None
+
+        if page_data is not None:
+            self._n_data_route_failures = 0
+            return page_data
+
+        self._n_data_route_failures += 1
+
+        is_not_found = response.status_code == HTTPStatus.NOT_FOUND
+
+        if is_not_found or self._n_data_route_failures >= MAX_DATA_ROUTE_FAILURES:
+            logger.info(f'Data route failed for build id {build_id}, using html.')
+            self._failed_build_id = build_id
+        else:
+            logger.debug(f'Data route failed with status {response.status_code}, falling back to html.')
+
+        return None
+
+
+def _parse_data_route(content: bytes) -> Optional[Dict]:
+    """
+    Returns the page data of a data route response, or None if it isn't
+    page props e.g., invalid json, a redirect or not found.
+    """
+    try:
+        page_data = json.loads(content)
+    except ValueError:
+        return None
+
+    if not isinstance(page_data, Dict) or page_data.get('notFound'):
+        return None
+
+    page_props = page_data.get('pageProps')
+
+    if not isinstance(page_props, Dict) or '__N_REDIRECT' in page_props:
+        return None
+
+    return page_data
+
+
+def _request_with_retry(url: Url):
+    i_retry = 0
+    response = requests.get(url=url, timeout=REQUEST_TIMEOUT_S)
+
+    while response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        retry_after_s = int(response.headers["Retry-After"])
+        sleep_s = retry_after_s * TOO_MANY_REQUESTS_BACKOFF_FACTOR ** i_retry
+
+        logger.debug(f'{threading.get_native_id()}: Too many requests. Sleeping {sleep_s} s.')
+
+        time.sleep(sleep_s)
+
+        response = requests.get(url=url, timeout=REQUEST_TIMEOUT_S)
+        i_retry += 1
+
+    return response
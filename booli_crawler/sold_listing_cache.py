@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from booli_crawler.sold_listing_list import SoldListingList
+from booli_crawler.types import PropertyType
+from booli_crawler.url import Url
+
+INDEX_FILE_NAME = "index.json"
+DEAD_LETTERS_FILE_NAME = "dead_letters.json"
+
+TMP_SUFFIX = ".tmp"
+LEGACY_SUFFIX = ".legacy"
+
+MONTH_FORMAT = "%Y-%m"
+MONTH_DIR_FORMAT = "{month}.v{version}"
+
+N_DAY_OFFSETS = 32
+
+DateSoldRange = Tuple[datetime, datetime]
+
+logger = logging.getLogger(__name__)
+
+
+def _to_int_array(values: List) -> np.ndarray:
+    return np.array(values, dtype=np.int64)
+
+
+def _to_float_array(values: List) -> np.ndarray:
+    return np.array(values, dtype=np.float64)
+
+
+def _to_str_array(values: List) -> np.ndarray:
+    return np.array(values, dtype=np.str_)
+
+
+def _from_array(values: np.ndarray) -> List:
+    return values.tolist()
+
+
+def _to_property_type_array(values: List) -> np.ndarray:
+    return np.array([value.value for value in values], dtype=np.int8)
+
+
+def _from_property_type_array(values: np.ndarray) -> List:
+    return [PropertyType(value) for value in values.tolist()]
+
+
+def _to_date_array(values: List) -> np.ndarray:
+    return np.array(values, dtype='datetime64[D]')
+
+
+def _from_date_array(values: np.ndarray) -> List:
+    return values.astype('datetime64[us]').tolist()
+
+
+# Per member: to/from array and the value stored in place of None. Which
+# values are None is stored separately (a mask), i.e., the fill is never read.
+COLUMNS = {
+    'price_sek': (_to_int_array, _from_array, 0),
+    'property_type': (_to_property_type_array, _from_property_type_array, PropertyType.Unknown),
+    'rooms': (_to_int_array, _from_array, 0),
+    'area_m2': (_to_float_array, _from_array, 0.0),
+    'street': (_to_str_array, _from_array, ''),
+    'district': (_to_str_array, _from_array, ''),
+    'date_sold': (_to_date_array, _from_date_array, datetime.min),
+    'url': (_to_str_array, _from_array, ''),
+}
+
+
+class SoldListingCache:
+
+    def __init__(self, path: Path):
+        """
+        Date partitioned cache of sold listings. Each month is stored
+        as a directory of fixed-width column files (.npy), sorted on
+        date sold, plus a mask per column of which values are None.
+        An index holds the directory, number of rows and the row
+        offset of each day per month.
+
+        Loading a date sold range memory-maps the column files and
+        only copies the rows of the requested days. A rewritten month
+        gets a new directory and the index is replaced atomically
+        last, i.e., an interrupted store leaves the previous cache.
+        A legacy (pickled) cache found at path is migrated on first use.
+
+        Urls of pages which failed to be crawled (dead letters) are
+        kept next to the index, to be re-crawled by the next call.
+        """
+        self._path = path
+
+        legacy_path = self._path.with_name(self._path.name + LEGACY_SUFFIX)
+
+        if self._path.is_file():
+            self._migrate_from_pickle(pickle_path=self._path)
+        elif not self._path.exists() and legacy_path.is_file():
+            self._migrate_from_pickle(pickle_path=legacy_path)
+
+        self._index = self._read_index()
+
+    def date_sold_range(self) -> Optional[DateSoldRange]:
+        """
+        Returns the min and max date sold in the cache or None
+        if the cache is empty.
+        """
+        months = sorted(month for month, entry in self._index.items() if entry['n_rows'] > 0)
+
+        if not months:
+            return None
+
+        min_date_sold = self._load_month(months[0], columns=['date_sold'], start=0, stop=1)['date_sold'][0]
+        max_date_sold = self._load_month(months[-1], columns=['date_sold'],
+                                         start=self._index[months[-1]]['n_rows'] - 1,
+                                         stop=self._index[months[-1]]['n_rows'])['date_sold'][0]
+
+        return min_date_sold, max_date_sold
+
+    def load(self, from_date_sold: datetime, to_date_sold: datetime) -> SoldListingList:
+        """
+        Loads the sold listings with from_date_sold <= date sold <= to_date_sold.
+        """
+        sold_listings_dict = {member: [] for member in COLUMNS}
+
+        for month in sorted(self._index):
+            month_start = datetime.strptime(month, MONTH_FORMAT)
+
+            if month_start > to_date_sold or month < from_date_sold.strftime(MONTH_FORMAT):
+                continue
+
+            day_offsets = self._index[month]['day_offsets']
+
+            if month == from_date_sold.strftime(MONTH_FORMAT):
+                start = day_offsets[from_date_sold.day - 1]
+                if from_date_sold.time() != datetime.min.time():
+                    start = day_offsets[from_date_sold.day]
+            else:
+                start = 0
+
+            if month == to_date_sold.strftime(MONTH_FORMAT):
+                stop = day_offsets[to_date_sold.day]
+            else:
+                stop = self._index[month]['n_rows']
+
+            if start < stop:
+                month_dict = self._load_month(month, columns=list(COLUMNS), start=start, stop=stop)
+
+                for member, values in month_dict.items():
+                    sold_listings_dict[member] += values
+
+        sold_listings = SoldListingList()
+        sold_listings.from_dict(sold_listings_dict)
+
+        return sold_listings
+
+    def store(self, sold_listings: SoldListingList):
+        """
+        Merges sold listings into the cache. Only the months
+        present in sold_listings are rewritten.
+        """
+        new_columns = {member: self._to_arrays(member, getattr(sold_listings, member)) for member in COLUMNS}
+        new_months = np.datetime_as_string(new_columns['date_sold'][0].astype('datetime64[M]'))
+
+        index = dict(self._index)
+
+        for month in np.unique(new_months).tolist():
+            use_indices = new_months == month
+            columns = {member: (values[use_indices], is_none[use_indices])
+                       for member, (values, is_none) in new_columns.items()}
+
+            if month in self._index:
+                columns = {member: (np.concatenate([np.load(self._column_path(month, member)), values]),
+                                    np.concatenate([np.load(self._is_none_path(month, member)), is_none]))
+                           for member, (values, is_none) in columns.items()}
+
+            index[month] = self._write_month(month, columns)
+
+        self._write_json(self._path / INDEX_FILE_NAME, index)
+
+        replaced_month_dirs = [entry['dir'] for month, entry in self._index.items()
+                               if index[month] is not entry]
+        self._index = index
+
+        for month_dir in replaced_month_dirs:
+            shutil.rmtree(self._path / month_dir, ignore_errors=True)
+
+    def load_dead_letters(self) -> List[Url]:
+        dead_letters_path = self._path / DEAD_LETTERS_FILE_NAME
+
+        if dead_letters_path.exists():
+            with open(dead_letters_path, mode="r") as file:
+                return json.load(file)
+        else:
+            return []
+
+    def store_dead_letters(self, urls: List[Url]):
+        """
+        Stores the dead letters, replacing the previous ones.
+        """
+        self._write_json(self._path / DEAD_LETTERS_FILE_NAME, urls)
+
+    @staticmethod
+    def _to_arrays(member: str, values: List) -> Tuple[np.ndarray, np.ndarray]:
+        to_array, _, fill = COLUMNS[member]
+
+        is_none = np.array([value is None for value in values], dtype=bool)
+        values = to_array([fill if value is None else value for value in values])
+
+        return values, is_none
+
+    def _load_month(self, month: str, columns: List[str], start: int, stop: int) -> Dict:
+        month_dict = {}
+
+        for member in columns:
+            values = np.load(self._column_path(month, member), mmap_mode='r')
+            is_none = np.load(self._is_none_path(month, member), mmap_mode='r')
+            _, from_array, _ = COLUMNS[member]
+
+            month_dict[member] = [None if value_is_none else value
+                                  for value, value_is_none in zip(from_array(np.array(values[start:stop])),
+                                                                  is_none[start:stop].tolist())]
+
+        return month_dict
+
+    def _write_month(self, month: str, columns: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> Dict:
+        """
+        Writes the columns of the month to a new directory and
+        returns its index entry.
+        """
+        dates_sold, _ = columns['date_sold']
+        order = np.argsort(dates_sold, kind='stable')
+        days = (dates_sold[order] - dates_sold.astype('datetime64[M]')[order]).astype(int) + 1
+
+        version = self._index[month]['version'] + 1 if month in self._index else 0
+        month_dir = MONTH_DIR_FORMAT.format(month=month, version=version)
+
+        shutil.rmtree(self._path / month_dir, ignore_errors=True)
+        (self._path / month_dir).mkdir(parents=True)
+
+        for member, (values, is_none) in columns.items():
+            np.save(self._path / month_dir / f"{member}.npy", values[order])
+            np.save(self._path / month_dir / f"{member}.is_none.npy", is_none[order])
+
+        return {
+            'dir': month_dir,
+            'version': version,
+            'n_rows': len(order),
+            'day_offsets': np.searchsorted(days, np.arange(1, N_DAY_OFFSETS + 1)).tolist(),
+        }
+
+    def _column_path(self, month: str, member: str) -> Path:
+        return self._path / self._index[month]['dir'] / f"{member}.npy"
+
+    def _is_none_path(self, month: str, member: str) -> Path:
+        return self._path / self._index[month]['dir'] / f"{member}.is_none.npy"
+
+    def _read_index(self) -> Dict:
+        index_path = self._path / INDEX_FILE_NAME
+
+        if index_path.exists():
+            with open(index_path, mode="r") as file:
+                return json.load(file)
+        else:
+            return {}
+
+    def _write_json(self, path: Path, data: Any):
+        """
+        Writes to a temporary file which then atomically replaces path.
+        """
+        self._path.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+
+        with open(tmp_path, mode="w") as file:
+            json.dump(data, file)
+
+        os.replace(tmp_path, path)
+
+    def _migrate_from_pickle(self, pickle_path: Path):
+        """
+        Migrates into a temporary cache next to path which is renamed
+        into place. The pickle is kept (as legacy) until the rename is done.
+        """
+        logger.info(f"Migrating legacy cache at {pickle_path}")
+
+        sold_listings = SoldListingList()
+        sold_listings.from_file(path=pickle_path)
+
+        tmp_path = self._path.with_name(self._path.name + TMP_SUFFIX)
+        legacy_path = self._path.with_name(self._path.name + LEGACY_SUFFIX)
+
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        tmp_cache = SoldListingCache(path=tmp_path)
+        tmp_cache.store(sold_listings)
+
+        if pickle_path != legacy_path:
+            os.replace(pickle_path, legacy_path)
+
+        os.replace(tmp_path, self._path)
+        legacy_path.unlink()
@@ -2,7 +2,7 @@ import pickle
 import sys
 from pathlib import Path
 from threading import Lock
-from typing import Dict, Any, IO
+from typing import Dict, Any, IO, List
 
 import pandas as pd
 
@@ -28,26 +28,38 @@ class SoldListingList:
 
                 values.append(new_value)
 
+    def extend(self, sold_listings: List[SoldListing]):
+        """
+        Appends sold listings in bulk i.e., holding the
+        lock once instead of once per sold listing.
+        """
+        new_values = {member: [getattr(sold_listing, member) for sold_listing in sold_listings]
+                      for member in self._members}
+
+        with self._lock:
+            for member in self._members:
+                getattr(self, member).extend(new_values[member])
+
     def to_file(self, path: Path):
         with open(path, mode="wb") as file:
-            self._pickle_dump_with_large_recursion_limit(self._to_dict(), file)
+            self._pickle_dump_with_large_recursion_limit(self.to_dict(), file)
 
     def from_file(self, path: Path):
         with open(path, mode="rb") as file:
-            self._from_dict(pickle.load(file))
+            self.from_dict(pickle.load(file))
 
     def to_pd_frame(self) -> pd.DataFrame:
-        df = pd.DataFrame(self._to_dict())
+        df = pd.DataFrame(self.to_dict())
 
         df.index = [pd.Timestamp(ds) for ds in df.date_sold]
         df = df.sort_index(ascending=False)
 
         return df
 
-    def _to_dict(self) -> Dict:
+    def to_dict(self) -> Dict:
         return {key: getattr(self, key) for key in self._members}
 
-    def _from_dict(self, sold_listings: Dict):
+    def from_dict(self, sold_listings: Dict):
         for member in self._members:
             values = sold_listings.get(member)
             setattr(self, member, values)
@@ -1,25 +1,27 @@
+import itertools
 import logging
-import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List, Callable
+from typing import Optional, List, Callable, Set, Dict, Tuple
 
 import pandas as pd
 from tqdm import tqdm
 
-from booli_crawler.crawler import Crawler
+from booli_crawler.crawler import Crawler, CrawlQueue, call_with_retry, crawl_page_with_retry, parse_listings
+from booli_crawler.page_fetcher import PageFetcher
 from booli_crawler.parser import Parser
+from booli_crawler.sold_listing_cache import SoldListingCache, DateSoldRange
 from booli_crawler.sold_listing_list import SoldListingList
-from booli_crawler.types import City
-from booli_crawler.url import get_page_url, UrlQueue, Url, get_num_of_pages, UrlParseError
-
-SLEEP_CHECK_QUEUE_S = 1
+from booli_crawler.types import City, SoldListing
+from booli_crawler.url import get_page_url, Url, parse_num_of_pages, UrlParseError, PageUrl
 
 DEFAULT_CACHE_PATH = Path.home() / ".booli_crawler_cache"
 
 DATETIME_ONE_DAY = timedelta(days=1)
 DATETIME_ONE_WEEK = timedelta(weeks=1)
 
+DEAD_LETTERS_ATTR = 'dead_letters'
+
 Pages = List[int]
 Urls = List[Url]
 
@@ -43,83 +45,248 @@ def get(city: City,
         n_crawlers: int = 1,
         use_cache: bool = True,
         cache_path: Path = DEFAULT_CACHE_PATH,
+        refresh: bool = False,
+        use_data_route: bool = False,
         show_progress_bar: bool = False) -> pd.DataFrame:
     """
     Crawls and returns the sold listings per page given
     a city.
 
+    Pages which still fail after retries (dead letters) are returned
+    as a list of urls in the attrs of the frame ('dead_letters'), and
+    stored in the cache (if used) to be re-crawled by the next call.
+
     :param city: Selected city to crawl.
     :param from_date_sold: From date sold to crawl.
     :param to_date_sold: To date sold to crawl.
     :param pages: Explicitly defines pages to parse, between dates sold.
     :param n_crawlers: Use to thread the crawling.
     :param use_cache: Enable to use cache between calls.
-    :param cache_path: Path to where the cache is/will be stored.
+    :param cache_path: Path to where the cache is/will be stored, suffixed by
+        the city name e.g., '.booli_crawler_cache_linkoping'. A cache at
+        cache_path itself (without city) isn't used, only warned about.
+    :param refresh: Enable to crawl sold listings newer than the cache page by
+        page (newest first), stopping at the first page with only cached listings.
+        Requires use_cache, pages is ignored for the newer listings. If a page
+        still fails after retries, the refresh is dropped (retried next call).
+    :param use_data_route: Enable to fetch the json data route of pages instead
+        of the full html. Falls back to html if the data route fails.
     :param show_progress_bar: Set true for progress bar.
 
-    :return: Sold listings given the city.
+    :return: Sold listings given the city, with the urls of the pages which
+        failed in attrs['dead_letters'].
+    """
+    return _get(cities=[city],
+                cache_path=cache_path,
+                from_date_sold=from_date_sold,
+                to_date_sold=to_date_sold,
+                pages=pages,
+                n_crawlers=n_crawlers,
+                use_cache=use_cache,
+                refresh=refresh,
+                use_data_route=use_data_route,
+                show_progress_bar=show_progress_bar)[city]
+
+
+def get_many(cities: List[City],
+             from_date_sold: Optional[datetime] = datetime.fromtimestamp(0),
+             to_date_sold: Optional[datetime] = datetime.now(),
+             pages: Optional[Pages] = None,
+             n_crawlers: int = 1,
+             use_cache: bool = True,
+             cache_path: Path = DEFAULT_CACHE_PATH,
+             refresh: bool = False,
+             use_data_route: bool = False,
+             show_progress_bar: bool = False) -> Dict[City, pd.DataFrame]:
+    """
+    Crawls and returns the sold listings per page given several
+    cities. All cities are planned up front and their pages are
+    interleaved over one shared pool of crawlers. Duplicate cities
+    are crawled once.
+
+    Uses the same cache per city as get. See get for the params.
+
+    :return: Sold listings per city.
     """
+    return _get(cities=cities,
+                cache_path=cache_path,
+                from_date_sold=from_date_sold,
+                to_date_sold=to_date_sold,
+                pages=pages,
+                n_crawlers=n_crawlers,
+                use_cache=use_cache,
+                refresh=refresh,
+                use_data_route=use_data_route,
+                show_progress_bar=show_progress_bar)
+
+
+def _get(cities: List[City],
+         cache_path: Path,
+         from_date_sold: datetime,
+         to_date_sold: datetime,
+         pages: Optional[Pages],
+         n_crawlers: int,
+         use_cache: bool,
+         refresh: bool,
+         use_data_route: bool,
+         show_progress_bar: bool) -> Dict[City, pd.DataFrame]:
+    cities = list(dict.fromkeys(cities))
+
     parser = Parser()
-    sold_listings = SoldListingList()
+    page_fetcher = PageFetcher(use_data_route=use_data_route)
+
+    caches = {}
+    cached_date_sold_ranges = {}
+    sold_listings = {city: SoldListingList() for city in cities}
 
     if use_cache:
-        if cache_path.exists():
-            logger.debug(f"Cache found at {cache_path}, loading")
-            sold_listings.from_file(path=cache_path)
+        _warn_about_cache_without_city(cache_path=cache_path, cities=cities)
+
+    for city in cities:
+        if use_cache:
+            city_cache_path = _get_city_cache_path(cache_path=cache_path, city=city)
+            logger.debug(f"Using cache at {city_cache_path}")
+            caches[city] = SoldListingCache(path=city_cache_path)
+            cached_date_sold_ranges[city] = caches[city].date_sold_range()
         else:
-            logger.debug(f"No cache found at {cache_path}")
-    else:
-        logger.debug("Skipping caching, not requested")
+            logger.debug("Skipping caching, not requested")
+            cached_date_sold_ranges[city] = None
+
+    urls = {city: _get_urls_based_on_date_sold(parser=parser,
+                                               page_fetcher=page_fetcher,
+                                               sold_listings=sold_listings[city],
+                                               city=city,
+                                               from_date_sold=from_date_sold,
+                                               to_date_sold=to_date_sold,
+                                               pages=pages,
+                                               cached_date_sold_range=cached_date_sold_ranges[city],
+                                               refresh=refresh)
+            for city in cities}
+
+    for city, cache in caches.items():
+        dead_letters = cache.load_dead_letters()
+
+        if dead_letters:
+            logger.info(f"Re-crawling {len(dead_letters)} failed pages of {city.name}")
+            urls[city] = dead_letters + urls[city]
+
+    url_queue = CrawlQueue()
 
-    url_queue = UrlQueue(urls=_get_urls_based_on_date_sold(city=city,
-                                                           from_date_sold=from_date_sold,
-                                                           to_date_sold=to_date_sold,
-                                                           pages=pages,
-                                                           cached_date_sold=sold_listings.date_sold))
+    for city_urls in itertools.zip_longest(*[[(url, city) for url in urls[city]] for city in cities]):
+        for url, city in filter(None, city_urls):
+            url_queue.put_url(url=url, sold_listings=sold_listings[city])
 
     if show_progress_bar:
         progress_bar_cb = tqdm(total=url_queue.qsize(), desc='Crawling booli').update
     else:
         progress_bar_cb = lambda: None
 
-    _crawl_pages(parser=parser,
-                 sold_listings=sold_listings,
-                 url_queue=url_queue,
-                 n_crawlers=n_crawlers,
-                 page_crawled_cb=progress_bar_cb)
+    for city, cached_date_sold_range in cached_date_sold_ranges.items():
+        if refresh and cached_date_sold_range is not None and to_date_sold > cached_date_sold_range[1]:
+            _, max_cached_date_sold = cached_date_sold_range
+            cached_urls = caches[city].load(from_date_sold=max_cached_date_sold,
+                                            to_date_sold=to_date_sold).url
+
+            _refresh_pages(parser=parser,
+                           page_fetcher=page_fetcher,
+                           sold_listings=sold_listings[city],
+                           page_url=get_page_url(city=city,
+                                                 from_date_sold=max_cached_date_sold,
+                                                 to_date_sold=to_date_sold),
+                           max_cached_date_sold=max_cached_date_sold,
+                           cached_urls=set(cached_urls))
+
+    failed_urls = _crawl_pages(parser=parser,
+                               page_fetcher=page_fetcher,
+                               url_queue=url_queue,
+                               n_crawlers=n_crawlers,
+                               page_crawled_cb=progress_bar_cb)
+
+    dead_letters = {city: [url for url, failed_sold_listings in failed_urls
+                           if failed_sold_listings is sold_listings[city]]
+                    for city in cities}
+
+    for city, city_dead_letters in dead_letters.items():
+        if city_dead_letters:
+            logger.warning(f"Failed to crawl {len(city_dead_letters)} pages of {city.name}: "
+                           f"{city_dead_letters}")
 
     if use_cache:
-        logger.debug(f"Storing cache to {cache_path}")
-        sold_listings.to_file(path=cache_path)
+        for city, cache in caches.items():
+            logger.debug(f"Storing cache of {city.name}")
+            cache.store(sold_listings=sold_listings[city])
+            cache.store_dead_letters(urls=dead_letters[city])
 
-        return _to_pd_frame_and_filter_on_date_sold(sold_listings=sold_listings,
-                                                    from_date_sold=from_date_sold,
-                                                    to_date_sold=to_date_sold)
+        frames = {city: cache.load(from_date_sold=from_date_sold, to_date_sold=to_date_sold).to_pd_frame()
+                  for city, cache in caches.items()}
     else:
-        return sold_listings.to_pd_frame()
+        frames = {city: city_sold_listings.to_pd_frame()
+                  for city, city_sold_listings in sold_listings.items()}
 
+    for city, frame in frames.items():
+        frame.attrs[DEAD_LETTERS_ATTR] = dead_letters[city]
 
-def _get_urls_based_on_date_sold(city: City,
+    return frames
+
+
+def _get_city_cache_path(cache_path: Path, city: City) -> Path:
+    return cache_path.with_name(f"{cache_path.name}_{city.name.lower()}")
+
+
+def _warn_about_cache_without_city(cache_path: Path, cities: List[City]):
+    """
+    The cache used to be stored at cache_path, for whichever city was
+    crawled. Its city is unknown, i.e., it's left as is and warned about.
+    """
+    if cache_path.exists():
+        city_cache_paths = [str(_get_city_cache_path(cache_path=cache_path, city=city)) for city in cities]
+
+        logger.warning(f"Not using cache at {cache_path} as its city is unknown, "
+                       f"move it to the cache of its city to use it e.g., one of {city_cache_paths}")
+
+
+def _get_urls_based_on_date_sold(parser: Parser,
+                                 page_fetcher: PageFetcher,
+                                 sold_listings: SoldListingList,
+                                 city: City,
                                  from_date_sold: datetime,
                                  to_date_sold: datetime,
                                  pages: List[int],
-                                 cached_date_sold: List[datetime]) -> Urls:
+                                 cached_date_sold_range: Optional[DateSoldRange],
+                                 refresh: bool = False) -> Urls:
+    """
+    Returns the urls of the sold listings not in the cache. The newer
+    sold listings are left out when refreshing (see _refresh_pages).
+    Sold listings found while discovering pages are appended to
+    sold_listings (see _get_urls).
+    """
     urls = []
 
-    if cached_date_sold:
-        if from_date_sold < min(cached_date_sold):
-            urls += _get_urls(city=city,
+    if cached_date_sold_range is not None:
+        min_cached_date_sold, max_cached_date_sold = cached_date_sold_range
+
+        if from_date_sold < min_cached_date_sold:
+            urls += _get_urls(parser=parser,
+                              page_fetcher=page_fetcher,
+                              sold_listings=sold_listings,
+                              city=city,
                               from_date_sold=from_date_sold,
-                              to_date_sold=min(cached_date_sold),
+                              to_date_sold=min_cached_date_sold,
                               pages=pages)
 
-        if to_date_sold > max(cached_date_sold):
-            urls += _get_urls(city=city,
-                              from_date_sold=max(cached_date_sold),
+        if to_date_sold > max_cached_date_sold and not refresh:
+            urls += _get_urls(parser=parser,
+                              page_fetcher=page_fetcher,
+                              sold_listings=sold_listings,
+                              city=city,
+                              from_date_sold=max_cached_date_sold,
                               to_date_sold=to_date_sold,
                               pages=pages)
     else:
-        urls += _get_urls(city=city,
+        urls += _get_urls(parser=parser,
+                          page_fetcher=page_fetcher,
+                          sold_listings=sold_listings,
+                          city=city,
                           from_date_sold=from_date_sold,
                           to_date_sold=to_date_sold,
                           pages=pages)
@@ -127,48 +294,123 @@ def _get_urls_based_on_date_sold(city: City,
     return urls
 
 
-def _to_pd_frame_and_filter_on_date_sold(sold_listings: SoldListingList,
-                                         from_date_sold: datetime,
-                                         to_date_sold: datetime) -> pd.DataFrame:
-    pd_frame = sold_listings.to_pd_frame()
-    use_indices = (from_date_sold <= pd_frame.date_sold) & (pd_frame.date_sold <= to_date_sold)
+def _refresh_pages(parser: Parser,
+                   page_fetcher: PageFetcher,
+                   sold_listings: SoldListingList,
+                   page_url: PageUrl,
+                   max_cached_date_sold: datetime,
+                   cached_urls: Set[Url]) -> SoldListingList:
+    """
+    Crawls pages in order, i.e., newest sold listings first, and
+    appends the ones not already cached. Sold listings older than
+    max_cached_date_sold are covered by the cache. Stops at the first
+    page containing only cached (or no) sold listings, at the last
+    page (given by the first page) or at a page shorter than the first.
+
+    Pages are retried as by a Crawler. If a page still fails, nothing
+    is appended, i.e., the cache isn't extended past the failed page.
+    """
+    refreshed_sold_listings = []
+
+    try:
+        first_page_html, first_page_sold_listings = _crawl_first_page(parser=parser,
+                                                                      page_fetcher=page_fetcher,
+                                                                      url=page_url(page=1))
+    except Exception as e:
+        logger.warning(f"Refresh failed on page 1, dropping it: {e!r}")
+        return sold_listings
+
+    try:
+        n_pages = parse_num_of_pages(html=first_page_html, url=page_url(page=1))
+    except UrlParseError:
+        n_pages = 1
+
+    for page in range(1, n_pages + 1):
+        if page == 1:
+            page_sold_listings = first_page_sold_listings
+        else:
+            try:
+                page_sold_listings = crawl_page_with_retry(parser=parser,
+                                                           page_fetcher=page_fetcher,
+                                                           url=page_url(page=page))
+            except Exception as e:
+                logger.warning(f"Refresh failed on page {page}, dropping it: {e!r}")
+                return sold_listings
+
+        new_sold_listings = [sold_listing for sold_listing in page_sold_listings
+                             if sold_listing.date_sold >= max_cached_date_sold
+                             and sold_listing.url not in cached_urls]
+
+        if not new_sold_listings:
+            logger.debug(f"No new sold listings on page {page}, refresh done")
+            break
 
-    return pd_frame[use_indices]
+        refreshed_sold_listings += new_sold_listings
+        cached_urls.update(sold_listing.url for sold_listing in new_sold_listings)
+
+        if len(page_sold_listings) < len(first_page_sold_listings):
+            logger.debug(f"Page {page} is the last (short) page, refresh done")
+            break
+
+    sold_listings.extend(refreshed_sold_listings)
+
+    return sold_listings
 
 
 def _crawl_pages(parser: Parser,
-                 sold_listings: SoldListingList,
-                 url_queue: UrlQueue,
+                 page_fetcher: PageFetcher,
+                 url_queue: CrawlQueue,
                  n_crawlers: int,
-                 page_crawled_cb: Callable) -> SoldListingList:
+                 page_crawled_cb: Callable) -> List[Tuple[Url, SoldListingList]]:
+    """
+    Crawls all urls in the queue (including retries) and returns
+    the urls which failed, paired with their sold listings.
+    """
+    failed_urls = []
+
     crawlers = [Crawler(parser=parser,
+                        page_fetcher=page_fetcher,
                         url_queue=url_queue,
-                        sold_listings=sold_listings,
-                        page_crawled_cb=page_crawled_cb)
+                        page_crawled_cb=page_crawled_cb,
+                        page_failed_cb=lambda url, sold_listings: failed_urls.append((url, sold_listings)))
                 for _ in range(n_crawlers)]
 
     for crawler in crawlers:
         crawler.start()
 
-    while not url_queue.empty():
-        time.sleep(SLEEP_CHECK_QUEUE_S)
+    url_queue.join()
 
     for crawler in crawlers:
         crawler.stop()
 
-    return sold_listings
+    return failed_urls
 
 
-def _get_urls(city: City,
+def _get_urls(parser: Parser,
+              page_fetcher: PageFetcher,
+              sold_listings: SoldListingList,
+              city: City,
               from_date_sold: datetime,
               to_date_sold: datetime,
               pages: Optional[Pages]) -> Urls:
+    """
+    Discovers the number of pages by requesting the first page. The
+    sold listings of the first page are parsed and appended to
+    sold_listings (if requested), i.e., it's not part of the returned urls.
+
+    The first page is retried as by a Crawler. If it still fails, the
+    error is raised, as the pages to crawl are unknown.
+    """
     page_url = get_page_url(city=city,
                             from_date_sold=from_date_sold,
                             to_date_sold=to_date_sold)
 
+    first_page_html, first_page_sold_listings = _crawl_first_page(parser=parser,
+                                                                  page_fetcher=page_fetcher,
+                                                                  url=page_url(page=1))
+
     try:
-        n_pages = get_num_of_pages(url=page_url(page=1))
+        n_pages = parse_num_of_pages(html=first_page_html, url=page_url(page=1))
     except UrlParseError as e:
         if to_date_sold - from_date_sold > DATETIME_ONE_WEEK:
             raise e
@@ -184,4 +426,21 @@ def _get_urls(city: City,
     if n_pages < max(pages):
         raise PagesExceedsMax
 
-    return [page_url(page=page) for page in pages]
+    if 1 in pages:
+        sold_listings.extend(first_page_sold_listings)
+
+    return [page_url(page=page) for page in pages if page != 1]
+
+
+def _crawl_first_page(parser: Parser, page_fetcher: PageFetcher, url: Url) -> Tuple[str, List[SoldListing]]:
+    """
+    Crawls the first page, retried as by a Crawler. Returns its html
+    (holding the number of pages) and its sold listings.
+    """
+    def crawl() -> Tuple[str, List[SoldListing]]:
+        html = page_fetcher.fetch_html(url=url)
+        page_data = page_fetcher.find_page_data(html, url=url)
+
+        return html, parse_listings(parser=parser, page_data=page_data)
+
+    return call_with_retry(crawl, url=url)
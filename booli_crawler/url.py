@@ -1,10 +1,9 @@
 import re
 from datetime import datetime
-from queue import Queue
-from typing import Protocol
+from typing import Dict, Protocol
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 import numpy as np
-import requests
 
 from booli_crawler.types import City
 
@@ -16,6 +15,8 @@ SOLD_LISTINGS_URL = BASE_URL + "/slutpriser/{city_name}/{city_code}?" \
                                "sort=soldDate" \
                                "&page={page}"
 
+DATA_ROUTE_PATH = "/_next/data/{build_id}{path}.json"
+
 DATETIME_FORMAT = '%Y-%m-%d'
 
 Url = str
@@ -26,15 +27,6 @@ class UrlParseError(Exception):
     pass
 
 
-class UrlQueue(Queue, object):
-
-    def __init__(self, urls: [Url]):
-        super(UrlQueue, self).__init__()
-
-        for url in urls:
-            self.put(url)
-
-
 class PageUrl(Protocol):
     def __call__(self, page: int) -> str:
         pass
@@ -54,15 +46,44 @@ def get_page_url(city: City,
                                                  to_date_sold=to_date_sold.strftime(DATETIME_FORMAT))
 
 
-def get_num_of_pages(url: Url) -> int:
+def get_data_url(url: Url, build_id: str, page: str, query: Dict[str, str]) -> Url:
     """
-    Find number of pages given the url by parsing the listing
-    index e.g., 'Visar sida <!-- -->35<!-- --> av <!-- -->27545'
+    Returns the Next.js data route of the url given the build id and the page
+    (route) the url is rewritten to, with the query added by the rewrite (see
+    get_rewrite_query). The dynamic segments of the page are filled from the
+    query e.g., '/slutpriser/linkoping/393?page=2' with page '/sok/[searchType]'
+    and query {'areaIds': '393', 'searchType': 'slutpriser'} ->
+    '/_next/data/<build_id>/sok/slutpriser.json?areaIds=393&page=2'
     """
-    response = requests.get(url=url)
+    scheme, netloc, _, url_query, fragment = urlsplit(url)
+    data_query = {**query, **dict(parse_qsl(url_query))}
+
+    try:
+        path = re.sub(r'\[(\w+)]', lambda match: data_query.pop(match.group(1)), page)
+    except KeyError as e:
+        raise UrlParseError(f"Missing {e} of page {page} for url: {url}")
+
+    return urlunsplit((scheme, netloc, DATA_ROUTE_PATH.format(build_id=build_id, path=path),
+                       urlencode(data_query, doseq=True), fragment))
+
 
+def get_rewrite_query(url: Url, query: Dict[str, str]) -> Dict[str, str]:
+    """
+    Returns the params of the query of a page (see __NEXT_DATA__) which
+    aren't in its url, i.e., the ones added by rewriting the url to the page.
+    """
+    url_query = dict(parse_qsl(urlsplit(url).query))
+
+    return {key: value for key, value in query.items() if key not in url_query}
+
+
+def parse_num_of_pages(html: str, url: Url) -> int:
+    """
+    Find number of pages given the html of the url by parsing the
+    listing index e.g., 'Visar sida <!-- -->35<!-- --> av <!-- -->27545'
+    """
     matches = re.search(pattern=r'Visar sida <!-- -->(\d+)<!-- --> av <!-- -->(\d+)',
-                        string=response.content.decode())
+                        string=html)
 
     if matches is None:
         raise UrlParseError(f"Could not parse number of pages from url: {url}")
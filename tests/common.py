@@ -1,3 +1,26 @@
+import dataclasses
+from datetime import datetime
 from pathlib import Path
 
+from booli_crawler.types import PropertyType, SoldListing
+
 RESOURCES_ROOT = Path(__file__).parent.resolve() / 'resources'
+RESOURCE_BOOLI_PAGE = RESOURCES_ROOT / 'booli_slutpriser_linkoping.html'
+
+
+def create_sold_listing(url: str = "/bostad/1",
+                        date_sold: datetime = datetime(2023, 6, 20),
+                        **members) -> SoldListing:
+    """
+    Creates a sold listing, where members (if any) replace the defaults.
+    """
+    sold_listing = SoldListing(price_sek=1,
+                               property_type=PropertyType.Vila,
+                               rooms=1,
+                               area_m2=1.0,
+                               street="Street",
+                               district="District",
+                               date_sold=date_sold,
+                               url=url)
+
+    return dataclasses.replace(sold_listing, **members)
@@ -0,0 +1,126 @@
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from booli_crawler.crawler import MAX_PAGE_RETRIES, CrawlQueue, Crawler, call_with_retry
+from booli_crawler.page_fetcher import PageFetcher, PageFetchError
+from booli_crawler.parser import Parser
+from booli_crawler.sold_listing_list import SoldListingList
+from .common import RESOURCE_BOOLI_PAGE
+from .mock_response import MockResponse
+
+
+OK_URL = 'ok'
+FAILING_URL = 'failing'
+NO_PAGE_DATA_URL = 'no_page_data'
+
+
+@pytest.fixture
+def local_responses():
+    with open(RESOURCE_BOOLI_PAGE, mode='rb') as f:
+        responses = {
+            OK_URL: MockResponse(content=f.read()),
+            FAILING_URL: MockResponse(content=b'', status_code=HTTPStatus.INTERNAL_SERVER_ERROR),
+            NO_PAGE_DATA_URL: MockResponse(content=b'<html></html>'),
+        }
+
+    with mock.patch('booli_crawler.crawler.PAGE_RETRY_BACKOFF_S', 0):
+        with mock.patch('requests.get', side_effect=lambda url, **_: responses[url]) as mocked_requests_get:
+            yield mocked_requests_get
+
+
+class FailingParser(Parser):
+
+    def parse_listing(self, listing):
+        raise KeyError('soldPrice')
+
+
+def run_crawlers(url_queue,
+                 n_crawlers,
+                 parser=Parser(),
+                 page_crawled_cb=lambda: None,
+                 page_failed_cb=lambda url, sl: None):
+    crawlers = [Crawler(parser=parser,
+                        page_fetcher=PageFetcher(),
+                        url_queue=url_queue,
+                        page_crawled_cb=page_crawled_cb,
+                        page_failed_cb=page_failed_cb)
+                for _ in range(n_crawlers)]
+
+    for crawler in crawlers:
+        crawler.start()
+
+    url_queue.join()
+
+    for crawler in crawlers:
+        crawler.stop()
+
+
+def test_crawler_retries_and_gives_up_on_failing_urls(local_responses):
+    sold_listings = SoldListingList()
+    url_queue = CrawlQueue()
+    failed_urls = []
+
+    for url in [FAILING_URL, OK_URL, NO_PAGE_DATA_URL]:
+        url_queue.put_url(url=url, sold_listings=sold_listings)
+
+    run_crawlers(url_queue=url_queue,
+                 n_crawlers=2,
+                 page_failed_cb=lambda url, failed_sl: failed_urls.append((url, failed_sl)))
+
+    assert sorted(url for url, _ in failed_urls) == [FAILING_URL, NO_PAGE_DATA_URL]
+    assert all(failed_sold_listings is sold_listings for _, failed_sold_listings in failed_urls)
+    assert len(sold_listings.url) > 0
+
+    requested_urls = [c.kwargs['url'] for c in local_responses.call_args_list]
+
+    assert requested_urls.count(FAILING_URL) == MAX_PAGE_RETRIES + 1
+    assert requested_urls.count(OK_URL) == 1
+
+
+def test_crawler_gives_up_on_parse_errors_without_retry(local_responses):
+    url_queue = CrawlQueue()
+    url_queue.put_url(url=OK_URL, sold_listings=SoldListingList())
+    failed_urls = []
+
+    run_crawlers(url_queue=url_queue,
+                 n_crawlers=1,
+                 parser=FailingParser(),
+                 page_failed_cb=lambda url, failed_sold_listings: failed_urls.append(url))
+
+    assert failed_urls == [OK_URL]
+    assert local_responses.call_count == 1
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_crawler_flushes_buffer_when_thread_dies(local_responses):
+    sold_listings = SoldListingList()
+    url_queue = CrawlQueue()
+    url_queue.put_url(url=OK_URL, sold_listings=sold_listings)
+
+    def page_crawled_cb():
+        raise RuntimeError
+
+    run_crawlers(url_queue=url_queue, n_crawlers=1, page_crawled_cb=page_crawled_cb)
+
+    assert len(sold_listings.url) > 0
+
+
+def test_call_with_retry_raises_after_max_retries(local_responses):
+    page_fetcher = PageFetcher()
+
+    with pytest.raises(PageFetchError):
+        call_with_retry(lambda: page_fetcher.fetch_html(url=FAILING_URL), url=FAILING_URL)
+
+    assert local_responses.call_count == MAX_PAGE_RETRIES + 1
+
+
+def test_call_with_retry_raises_parse_errors_at_once(local_responses):
+    page_fetcher = PageFetcher()
+
+    with pytest.raises(KeyError):
+        call_with_retry(lambda: FailingParser().parse_listing(page_fetcher.fetch_html(url=OK_URL)),
+                        url=OK_URL)
+
+    assert local_responses.call_count == 1
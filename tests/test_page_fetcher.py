@@ -0,0 +1,124 @@
+import json
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from booli_crawler.page_fetcher import MAX_DATA_ROUTE_FAILURES, PageFetcher
+from .common import RESOURCE_BOOLI_PAGE
+from .mock_response import MockResponse
+
+RESOURCE_BOOLI_BUILD_ID = 'yHBnVji5du5vOg1HIkJat'
+
+PAGE_URL = 'https://www.booli.se/slutpriser/linkoping/393?' \
+           'maxSoldDate=2023-06-27&minSoldDate=1970-01-01&sort=soldDate&page=1'
+DATA_URL = f'https://www.booli.se/_next/data/{RESOURCE_BOOLI_BUILD_ID}/sok/slutpriser.json?areaIds=393&' \
+           'maxSoldDate=2023-06-27&minSoldDate=1970-01-01&sort=soldDate&page=1'
+
+
+@pytest.fixture
+def html_content():
+    with open(RESOURCE_BOOLI_PAGE, mode='rb') as f:
+        yield f.read()
+
+
+@pytest.fixture
+def data_route_page_data(html_content):
+    """
+    The data route responds with the props of the page data.
+    """
+    yield PageFetcher().find_page_data(html_content.decode())['props']
+
+
+def mock_requests_get(html_content, data_route_response):
+    html_response = MockResponse(content=html_content)
+
+    return lambda url, **_: data_route_response if '/_next/data/' in url else html_response
+
+
+def test_fetch_page_data_without_data_route(html_content):
+    with mock.patch('requests.get', side_effect=mock_requests_get(html_content, None)) as mocked_requests_get:
+        page_fetcher = PageFetcher(use_data_route=False)
+
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+
+        assert [c.kwargs['url'] for c in mocked_requests_get.call_args_list] == [PAGE_URL, PAGE_URL]
+
+
+def test_fetch_page_data_with_data_route(html_content, data_route_page_data):
+    data_route_response = MockResponse(content=json.dumps(data_route_page_data).encode())
+
+    with mock.patch('requests.get',
+                    side_effect=mock_requests_get(html_content, data_route_response)) as mocked_requests_get:
+        page_fetcher = PageFetcher(use_data_route=True)
+
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+
+        assert page_fetcher.fetch_page_data(url=PAGE_URL) == data_route_page_data
+        assert [c.kwargs['url'] for c in mocked_requests_get.call_args_list] == [PAGE_URL, DATA_URL]
+
+
+@pytest.mark.parametrize("data_route_response", [
+    MockResponse(content=b'', status_code=HTTPStatus.NOT_FOUND),
+    MockResponse(content=b'<html>not json</html>'),
+    MockResponse(content=b'{"pageProps": {"__N_REDIRECT": "/slutpriser", "__N_REDIRECT_STATUS": 307}}'),
+    MockResponse(content=b'{"notFound": true}'),
+])
+def test_fetch_page_data_with_data_route_falls_back_to_html(html_content, data_route_response):
+    with mock.patch('requests.get',
+                    side_effect=mock_requests_get(html_content, data_route_response)) as mocked_requests_get:
+        page_fetcher = PageFetcher(use_data_route=True)
+
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+
+        assert page_fetcher.fetch_page_data(url=PAGE_URL)['buildId'] == RESOURCE_BOOLI_BUILD_ID
+        assert [c.kwargs['url'] for c in mocked_requests_get.call_args_list] == [PAGE_URL, DATA_URL, PAGE_URL]
+
+
+def test_fetch_page_data_with_failing_data_route_stops_using_it(html_content):
+    data_route_response = MockResponse(content=b'', status_code=HTTPStatus.NOT_FOUND)
+
+    with mock.patch('requests.get',
+                    side_effect=mock_requests_get(html_content, data_route_response)) as mocked_requests_get:
+        page_fetcher = PageFetcher(use_data_route=True)
+
+        for _ in range(4):
+            page_fetcher.fetch_page_data(url=PAGE_URL)
+
+        assert [c.kwargs['url'] for c in mocked_requests_get.call_args_list] == \
+               [PAGE_URL, DATA_URL, PAGE_URL, PAGE_URL, PAGE_URL]
+
+
+def test_fetch_page_data_with_transient_failing_data_route_stops_using_it_after_max(html_content):
+    data_route_response = MockResponse(content=b'', status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    with mock.patch('requests.get',
+                    side_effect=mock_requests_get(html_content, data_route_response)) as mocked_requests_get:
+        page_fetcher = PageFetcher(use_data_route=True)
+
+        for _ in range(MAX_DATA_ROUTE_FAILURES + 2):
+            page_fetcher.fetch_page_data(url=PAGE_URL)
+
+        assert [c.kwargs['url'] for c in mocked_requests_get.call_args_list] == \
+               [PAGE_URL] + [DATA_URL, PAGE_URL] * MAX_DATA_ROUTE_FAILURES + [PAGE_URL]
+
+
+def test_fetch_page_data_with_failing_data_route_retries_new_build_id(html_content):
+    new_build_id = 'newBuildId'
+    new_html_content = html_content.replace(RESOURCE_BOOLI_BUILD_ID.encode(), new_build_id.encode())
+    data_route_response = MockResponse(content=b'', status_code=HTTPStatus.NOT_FOUND)
+
+    with mock.patch('requests.get',
+                    side_effect=mock_requests_get(html_content, data_route_response)) as mocked_requests_get:
+        page_fetcher = PageFetcher(use_data_route=True)
+
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+        page_fetcher.find_page_data(new_html_content.decode())
+        page_fetcher.fetch_page_data(url=PAGE_URL)
+
+        new_data_url = DATA_URL.replace(RESOURCE_BOOLI_BUILD_ID, new_build_id)
+
+        assert [c.kwargs['url'] for c in mocked_requests_get.call_args_list] == \
+               [PAGE_URL, DATA_URL, PAGE_URL, new_data_url, PAGE_URL]
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from booli_crawler.sold_listing_cache import SoldListingCache
+from booli_crawler.sold_listing_list import SoldListingList
+from .common import create_sold_listing
+
+TEST_CACHE_NAME = "test_cache"
+
+FIRST_DATE_SOLD = datetime.strptime("2023-01-25", '%Y-%m-%d')
+N_DAYS = 60
+
+
+@pytest.fixture
+def tmp_cache_path(tmp_path):
+    yield tmp_path / TEST_CACHE_NAME
+
+
+def create_sold_listings(n_days: int = N_DAYS) -> SoldListingList:
+    sold_listings = SoldListingList()
+
+    for day in range(n_days):
+        sold_listings.append(create_sold_listing(url=f"/bostad/{day}",
+                                                 date_sold=FIRST_DATE_SOLD + timedelta(days=day),
+                                                 price_sek=1000 * day,
+                                                 rooms=None if day % 2 else day,
+                                                 area_m2=None if day % 3 else day + 0.5,
+                                                 street=f"Street {day}",
+                                                 district=None if day % 2 else ''))
+
+    return sold_listings
+
+
+def load_all(cache: SoldListingCache) -> SoldListingList:
+    return cache.load(from_date_sold=datetime.min, to_date_sold=datetime.max)
+
+
+def test_date_sold_range_empty(tmp_cache_path):
+    assert SoldListingCache(path=tmp_cache_path).date_sold_range() is None
+
+
+def test_store_and_load_round_trip(tmp_cache_path):
+    sold_listings = create_sold_listings()
+
+    SoldListingCache(path=tmp_cache_path).store(sold_listings=sold_listings)
+    cache = SoldListingCache(path=tmp_cache_path)
+
+    assert cache.date_sold_range() == (min(sold_listings.date_sold), max(sold_listings.date_sold))
+    assert load_all(cache).to_dict() == sold_listings.to_dict()
+
+
+@pytest.mark.parametrize("from_date_sold, to_date_sold, exp_n_listings", [
+    (datetime(2023, 2, 1), datetime(2023, 2, 7), 7),
+    (datetime(2023, 1, 31), datetime(2023, 2, 1, 12), 2),
+    (datetime(2023, 1, 31, 12), datetime(2023, 2, 1), 1),
+    (datetime(2023, 1, 1), datetime(2023, 1, 24), 0),
+    (datetime(2023, 3, 20), datetime(2023, 12, 31), 6),
+])
+def test_load_date_sold_range(tmp_cache_path, from_date_sold, to_date_sold, exp_n_listings):
+    cache = SoldListingCache(path=tmp_cache_path)
+    cache.store(sold_listings=create_sold_listings())
+
+    date_sold = cache.load(from_date_sold=from_date_sold, to_date_sold=to_date_sold).date_sold
+
+    assert len(date_sold) == exp_n_listings
+    assert all(from_date_sold <= ds <= to_date_sold for ds in date_sold)
+
+
+def test_store_merges_months(tmp_cache_path):
+    cache = SoldListingCache(path=tmp_cache_path)
+    cache.store(sold_listings=create_sold_listings())
+    cache.store(sold_listings=create_sold_listings(n_days=10))
+
+    assert len(load_all(cache).date_sold) == N_DAYS + 10
+
+
+def test_migrate_from_pickle(tmp_cache_path):
+    sold_listings = create_sold_listings()
+    sold_listings.to_file(path=tmp_cache_path)
+
+    cache = SoldListingCache(path=tmp_cache_path)
+
+    assert tmp_cache_path.is_dir()
+    assert load_all(cache).to_dict() == sold_listings.to_dict()
+
+
+def test_interrupted_store_keeps_previous_cache(tmp_cache_path):
+    sold_listings = create_sold_listings()
+    SoldListingCache(path=tmp_cache_path).store(sold_listings=sold_listings)
+
+    with mock.patch('numpy.save', side_effect=[None, None, OSError]):
+        with pytest.raises(OSError):
+            SoldListingCache(path=tmp_cache_path).store(sold_listings=create_sold_listings(n_days=10))
+
+    cache = SoldListingCache(path=tmp_cache_path)
+
+    assert load_all(cache).to_dict() == sold_listings.to_dict()
+
+
+def test_interrupted_migrate_from_pickle_keeps_pickle(tmp_cache_path):
+    sold_listings = create_sold_listings()
+    sold_listings.to_file(path=tmp_cache_path)
+
+    with mock.patch.object(SoldListingCache, 'store', side_effect=OSError):
+        with pytest.raises(OSError):
+            SoldListingCache(path=tmp_cache_path)
+
+    assert tmp_cache_path.is_file()
+
+    cache = SoldListingCache(path=tmp_cache_path)
+
+    assert load_all(cache).to_dict() == sold_listings.to_dict()
+
+
+def test_store_and_load_dead_letters(tmp_cache_path):
+    dead_letters = ["/slutpriser/linkoping/393?page=2", "/slutpriser/linkoping/393?page=5"]
+
+    assert SoldListingCache(path=tmp_cache_path).load_dead_letters() == []
+
+    SoldListingCache(path=tmp_cache_path).store_dead_letters(urls=dead_letters)
+
+    assert SoldListingCache(path=tmp_cache_path).load_dead_letters() == dead_letters
@@ -0,0 +1,18 @@
+from booli_crawler.sold_listing_list import SoldListingList
+from .common import create_sold_listing
+
+N_SOLD_LISTINGS = 10
+
+
+def test_extend_equals_append():
+    sold_listings = [create_sold_listing(url=f"/bostad/{i}", price_sek=i) for i in range(N_SOLD_LISTINGS)]
+
+    appended = SoldListingList()
+    for sold_listing in sold_listings:
+        appended.append(sold_listing)
+
+    extended = SoldListingList()
+    extended.extend(sold_listings[:N_SOLD_LISTINGS // 2])
+    extended.extend(sold_listings[N_SOLD_LISTINGS // 2:])
+
+    assert extended.to_dict() == appended.to_dict()
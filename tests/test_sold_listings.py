@@ -1,16 +1,23 @@
 import collections
 from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import urlsplit
 from unittest import mock
 
 import pytest
 
-from booli_crawler.sold_listings import PagesNotUnique, PagesExceedsMax
+from booli_crawler.crawler import parse_listings
+from booli_crawler.page_fetcher import PageFetchError, PageFetcher
+from booli_crawler.parser import Parser
+from booli_crawler.sold_listing_cache import SoldListingCache
+from booli_crawler.sold_listing_list import SoldListingList
+from booli_crawler.sold_listings import DEAD_LETTERS_ATTR, PagesNotUnique, PagesExceedsMax, _refresh_pages
 from booli_crawler.sold_listings import get as sold_listings_get
+from booli_crawler.sold_listings import get_many as sold_listings_get_many
 from booli_crawler.types import City, SoldListing
-from .common import RESOURCES_ROOT
+from .common import RESOURCE_BOOLI_PAGE, create_sold_listing
 from .mock_response import MockResponse
 
-RESOURCE_BOOLI_PAGE = RESOURCES_ROOT / 'booli_slutpriser_linkoping.html'
 RESOURCE_BOOLI_CITY = City.Linkoping
 RESOURCE_BOOLI_MIN_DATE_SOLD = datetime.strptime("2023-06-20", '%Y-%m-%d')
 RESOURCE_BOOLI_MAX_DATE_SOLD = datetime.strptime("2023-06-27", '%Y-%m-%d')
@@ -33,6 +40,10 @@ def tmp_cache_path(tmp_path):
     yield tmp_path / TEST_CACHE_NAME
 
 
+def city_cache_path(cache_path, city=RESOURCE_BOOLI_CITY):
+    return cache_path.parent / f"{cache_path.name}_{city.name.lower()}"
+
+
 def assert_listings_integrity(listings):
     for member in SoldListing.__annotations__:
         values = getattr(listings, member)
@@ -47,6 +58,194 @@ def test_get_with_local_response(local_response):
     assert_listings_integrity(listings)
 
 
+REFRESH_MAX_CACHED_DATE_SOLD = datetime(2023, 6, 20)
+REFRESH_NEW_DATE_SOLD = datetime(2023, 6, 25)
+REFRESH_PAGES = {
+    'page1': [create_sold_listing('new1', REFRESH_NEW_DATE_SOLD),
+              create_sold_listing('new2', REFRESH_NEW_DATE_SOLD)],
+    'page2': [create_sold_listing('new1', REFRESH_NEW_DATE_SOLD),
+              create_sold_listing('new3', REFRESH_MAX_CACHED_DATE_SOLD)],
+    'page3': [create_sold_listing('cached', REFRESH_MAX_CACHED_DATE_SOLD),
+              create_sold_listing('old', datetime(2023, 6, 10))],
+    'page4': [create_sold_listing('new4', REFRESH_NEW_DATE_SOLD)],
+}
+
+
+REFRESH_PAGES_HTML = '<span>Visar sida <!-- -->1<!-- --> av <!-- -->{n_pages}</span>'
+
+
+def refresh_pages(crawl_page_side_effect, n_pages=len(REFRESH_PAGES)):
+    sold_listings = SoldListingList()
+
+    def crawl_first_page_side_effect(parser, page_fetcher, url):
+        return REFRESH_PAGES_HTML.format(n_pages=n_pages), crawl_page_side_effect(parser, page_fetcher, url)
+
+    with mock.patch('booli_crawler.sold_listings._crawl_first_page',
+                    side_effect=crawl_first_page_side_effect) as mocked_crawl_first_page:
+        with mock.patch('booli_crawler.sold_listings.crawl_page_with_retry',
+                        side_effect=crawl_page_side_effect) as mocked_crawl_page:
+            _refresh_pages(parser=None,
+                           page_fetcher=None,
+                           sold_listings=sold_listings,
+                           page_url=lambda page: f'page{page}',
+                           max_cached_date_sold=REFRESH_MAX_CACHED_DATE_SOLD,
+                           cached_urls={'cached'})
+
+    calls = mocked_crawl_first_page.call_args_list + mocked_crawl_page.call_args_list
+    crawled_urls = [c.kwargs['url'] for c in calls]
+
+    return sold_listings, crawled_urls
+
+
+def test_refresh_pages_stops_at_first_cached_page():
+    sold_listings, crawled_urls = refresh_pages(lambda parser, page_fetcher, url: REFRESH_PAGES[url])
+
+    assert crawled_urls == ['page1', 'page2', 'page3']
+    assert sold_listings.url == ['new1', 'new2', 'new3']
+
+
+def test_refresh_pages_stops_at_last_page():
+    sold_listings, crawled_urls = refresh_pages(lambda parser, page_fetcher, url: REFRESH_PAGES[url],
+                                                n_pages=2)
+
+    assert crawled_urls == ['page1', 'page2']
+    assert sold_listings.url == ['new1', 'new2', 'new3']
+
+
+def test_refresh_pages_stops_at_short_page():
+    short_pages = {**REFRESH_PAGES, 'page2': REFRESH_PAGES['page4']}
+
+    sold_listings, crawled_urls = refresh_pages(lambda parser, page_fetcher, url: short_pages[url])
+
+    assert crawled_urls == ['page1', 'page2']
+    assert sold_listings.url == ['new1', 'new2', 'new4']
+
+
+def test_refresh_pages_drops_refresh_on_failed_page():
+    def crawl_page_side_effect(parser, page_fetcher, url):
+        if url == 'page2':
+            raise PageFetchError
+        return REFRESH_PAGES[url]
+
+    sold_listings, crawled_urls = refresh_pages(crawl_page_side_effect)
+
+    assert crawled_urls == ['page1', 'page2']
+    assert sold_listings.url == []
+
+
+def test_get_with_local_response_reuses_discovered_page(local_response):
+    local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY, use_cache=False)
+
+    assert local_response.mocked_requests_get.call_count == 1
+
+
+def test_get_with_cache_recrawls_dead_letters(local_response, tmp_cache_path):
+    dead_letter = "https://www.booli.se/slutpriser/linkoping/393?page=2"
+    SoldListingCache(path=city_cache_path(tmp_cache_path)).store_dead_letters(urls=[dead_letter])
+
+    local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                     use_cache=True,
+                                     cache_path=tmp_cache_path,
+                                     from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                     to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    assert dead_letter in [c.kwargs['url'] for c in local_response.mocked_requests_get.call_args_list]
+    assert SoldListingCache(path=city_cache_path(tmp_cache_path)).load_dead_letters() == []
+
+
+def test_get_without_cache_returns_dead_letters():
+    with open(RESOURCE_BOOLI_PAGE, mode='rb') as f:
+        two_pages_response = MockResponse(content=f.read().replace(b'av <!-- -->1<', b'av <!-- -->2<'))
+
+    failing_response = MockResponse(content=b'', status_code=HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    with mock.patch('booli_crawler.crawler.PAGE_RETRY_BACKOFF_S', 0):
+        with mock.patch('requests.get',
+                        side_effect=lambda url, **_: (failing_response if 'page=2' in url
+                                                      else two_pages_response)):
+            listings = sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                         use_cache=False,
+                                         from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                         to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    assert_listings_integrity(listings)
+    assert [urlsplit(url).query for url in listings.attrs[DEAD_LETTERS_ATTR]] == \
+           ['maxSoldDate=2023-06-27&minSoldDate=2023-06-20&sort=soldDate&page=2']
+
+
+def test_get_many_with_local_response(local_response):
+    cities = [City.Linkoping, City.Stockholm]
+
+    listings_per_city = sold_listings_get_many(cities=cities, n_crawlers=2, use_cache=False)
+
+    assert list(listings_per_city) == cities
+    assert local_response.mocked_requests_get.call_count == len(cities)
+
+    for listings in listings_per_city.values():
+        assert_listings_integrity(listings)
+
+
+def test_get_many_with_duplicate_cities(local_response):
+    listings_per_city = sold_listings_get_many(cities=[RESOURCE_BOOLI_CITY, RESOURCE_BOOLI_CITY],
+                                               use_cache=False)
+    listings = local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY, use_cache=False)
+
+    assert list(listings_per_city) == [RESOURCE_BOOLI_CITY]
+    assert len(listings_per_city[RESOURCE_BOOLI_CITY]) == len(listings)
+
+
+def test_get_many_with_cache_per_city(local_response, tmp_cache_path):
+    cities = [City.Linkoping, City.Stockholm]
+
+    sold_listings_get_many(cities=cities,
+                           use_cache=True,
+                           cache_path=tmp_cache_path,
+                           from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                           to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    for city in cities:
+        assert city_cache_path(tmp_cache_path, city=city).is_dir()
+
+
+def test_get_and_get_many_share_cache(local_response, tmp_cache_path):
+    local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                     use_cache=True,
+                                     cache_path=tmp_cache_path,
+                                     from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                     to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    requests_get_call_count = local_response.mocked_requests_get.call_count
+
+    sold_listings_get_many(cities=[RESOURCE_BOOLI_CITY],
+                           use_cache=True,
+                           cache_path=tmp_cache_path,
+                           from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                           to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    assert local_response.mocked_requests_get.call_count == requests_get_call_count
+
+
+def test_get_leaves_cache_without_city(local_response, tmp_cache_path):
+    local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                     use_cache=True,
+                                     cache_path=tmp_cache_path,
+                                     from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                     to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    city_cache_path(tmp_cache_path).rename(tmp_cache_path)
+    requests_get_call_count = local_response.mocked_requests_get.call_count
+
+    local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                     use_cache=True,
+                                     cache_path=tmp_cache_path,
+                                     from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                     to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    assert tmp_cache_path.is_dir()
+    assert city_cache_path(tmp_cache_path).is_dir()
+    assert local_response.mocked_requests_get.call_count == requests_get_call_count + 1
+
+
 def test_get_with_remote_response():
     listings = sold_listings_get(city=City.Linkoping, pages=[1], use_cache=False)
 
@@ -111,3 +310,47 @@ def test_get_pages_not_unique(local_response):
 def test_get_pages_exceeds_max(local_response):
     with pytest.raises(PagesExceedsMax):
         local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY, use_cache=False, pages=[100_000])
+
+
+def test_get_with_cache_refresh_stops_at_cached_page(local_response, tmp_cache_path):
+    sold_listings_cached = local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                                            use_cache=True,
+                                                            cache_path=tmp_cache_path,
+                                                            from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                                            to_date_sold=RESOURCE_BOOLI_MAX_DATE_SOLD)
+
+    requests_get_call_count = local_response.mocked_requests_get.call_count
+
+    sold_listings_refreshed = local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                                               use_cache=True,
+                                                               cache_path=tmp_cache_path,
+                                                               from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                                               to_date_sold=datetime.now(),
+                                                               refresh=True)
+
+    assert local_response.mocked_requests_get.call_count == requests_get_call_count + 1
+    assert len(sold_listings_refreshed) == len(sold_listings_cached)
+
+
+def test_get_with_cache_refresh_stops_at_last_page(local_response, tmp_cache_path):
+    max_cached_date_sold = datetime(2023, 6, 22)
+
+    with open(RESOURCE_BOOLI_PAGE, mode='r') as f:
+        page_data = PageFetcher().find_page_data(f.read())
+
+    resource_sold_listings = parse_listings(parser=Parser(), page_data=page_data)
+
+    sold_listings = SoldListingList()
+    sold_listings.extend([sold_listing for sold_listing in resource_sold_listings
+                          if sold_listing.date_sold <= max_cached_date_sold])
+    SoldListingCache(path=city_cache_path(tmp_cache_path)).store(sold_listings=sold_listings)
+
+    sold_listings_refreshed = local_response.sold_listings_get(city=RESOURCE_BOOLI_CITY,
+                                                               use_cache=True,
+                                                               cache_path=tmp_cache_path,
+                                                               from_date_sold=RESOURCE_BOOLI_MIN_DATE_SOLD,
+                                                               to_date_sold=datetime.now(),
+                                                               refresh=True)
+
+    assert local_response.mocked_requests_get.call_count == 1
+    assert max(sold_listings_refreshed.date_sold) == RESOURCE_BOOLI_MAX_DATE_SOLD
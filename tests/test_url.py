@@ -1,9 +1,6 @@
-from unittest import mock
-
 import pytest
 
-from booli_crawler.url import get_num_of_pages
-from .mock_response import MockResponse
+from booli_crawler.url import parse_num_of_pages, get_data_url, get_rewrite_query
 
 LISTING_INDEX_FORMAT = '<span>Visar sida <!-- -->{listings_per_page}<!-- --> av <!-- -->{n_listings}</span>'
 
@@ -13,9 +10,25 @@ LISTING_INDEX_FORMAT = '<span>Visar sida <!-- -->{listings_per_page}<!-- --> av
     (17, 17, 1),
     (0, 0, 0),
 ])
-def test_get_num_of_pages(listings_per_page, n_listings, exp_n_pages):
-    content = LISTING_INDEX_FORMAT.format(listings_per_page=listings_per_page,
-                                          n_listings=n_listings)
+def test_parse_num_of_pages(listings_per_page, n_listings, exp_n_pages):
+    html = LISTING_INDEX_FORMAT.format(listings_per_page=listings_per_page,
+                                       n_listings=n_listings)
+
+    assert parse_num_of_pages(html=html, url='not/used') == exp_n_pages
+
+
+def test_get_data_url():
+    url = 'https://www.booli.se/slutpriser/linkoping/393?sort=soldDate&page=2'
+
+    assert get_data_url(url=url,
+                        build_id='abc',
+                        page='/sok/[searchType]',
+                        query={'areaIds': '393', 'searchType': 'slutpriser'}) == \
+           'https://www.booli.se/_next/data/abc/sok/slutpriser.json?areaIds=393&sort=soldDate&page=2'
+
+
+def test_get_rewrite_query():
+    url = 'https://www.booli.se/slutpriser/linkoping/393?sort=soldDate&page=1'
+    query = {'sort': 'soldDate', 'page': '1', 'areaIds': '393', 'searchType': 'slutpriser'}
 
-    with mock.patch('requests.get', return_value=MockResponse(content=content.encode())):
-        assert get_num_of_pages(url='not/used') == exp_n_pages
+    assert get_rewrite_query(url=url, query=query) == {'areaIds': '393', 'searchType': 'slutpriser'}